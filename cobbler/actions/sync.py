@@ -22,10 +22,24 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 """
 
 from builtins import object
-import glob
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import hashlib
+import itertools
+import mmap
 import os
+import shutil
+import threading
 import time
 
+jinja2_available = False
+try:
+    import jinja2
+    jinja2_available = True
+except:
+    """ FIXME: log a message here """
+    pass
+
 from cobbler.cexceptions import CX
 from cobbler import clogger
 from cobbler import templar
@@ -33,6 +47,80 @@ from cobbler import tftpgen
 from cobbler import utils
 from cobbler.utils import _
 
+# webdir subdirectories whose contents (but not the directory itself) are
+# wiped on every sync; frozenset so the per-entry membership test in
+# clean_trees is a hash lookup instead of a list scan
+_WEBDIR_CLEAN_DIRS = frozenset([
+    "autoinstall_templates", "autoinstall_templates_sys", "images", "systems",
+    "distros", "profiles", "repo_profile", "repo_system", "rendered",
+])
+
+# a shared jinja2 environment plus compiled templates keyed on source text;
+# rendering the tiny rsyncd.conf through a cached compiled template skips the
+# much heavier Cheetah startup in the templar
+_JINJA_ENV = jinja2.Environment(autoescape=False) if jinja2_available else None
+_JINJA_TEMPLATE_CACHE = {}
+
+
+def _compiled_jinja_template(source):
+    tpl = _JINJA_TEMPLATE_CACHE.get(source)
+    if tpl is None:
+        tpl = _JINJA_ENV.from_string(source)
+        _JINJA_TEMPLATE_CACHE[source] = tpl
+    return tpl
+
+
+def _classify_webdir_entry(name, is_file, keep_dirs):
+    """
+    Decide in one pass what clean_trees does with a webdir entry: 'keep' it,
+    remove a stray file ('rmfile'), wipe a directory's contents ('clean') or
+    remove the directory outright ('rmtree').
+    """
+    if is_file:
+        return "keep" if name.endswith(".py") else "rmfile"
+    if name in keep_dirs:
+        return "clean" if name in _WEBDIR_CLEAN_DIRS else "keep"
+    return "rmtree"
+
+
+# serial for scratch directory names in detach_tree_for_removal; the pid
+# alone is not unique when a scratch dir from an earlier sync still exists
+_SCRATCH_SERIAL = itertools.count()
+
+# records the object state the previous sync saw, so an unchanged
+# installation can skip the tree teardown/rebuild entirely
+_SYNC_STATE_FILE = "/var/lib/cobbler/.sync_state"
+
+# template file contents keyed on path, validated against (mtime, size), so
+# repeated syncs within one cobblerd process skip re-reading files that have
+# not changed; the stat is much cheaper than the open/read/close it replaces
+_TEMPLATE_CACHE = {}
+
+
+def _load_template(path):
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _TEMPLATE_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # map the file and decode straight out of the page cache rather than
+    # funneling it through a buffered file object first
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size:
+            mm = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+            try:
+                data = mm[:].decode('utf-8')
+            finally:
+                mm.close()
+        else:
+            data = ""
+    finally:
+        os.close(fd)
+    _TEMPLATE_CACHE[path] = (key, data)
+    return data
+
 
 class CobblerSync(object):
     """
@@ -53,6 +141,7 @@ class CobblerSync(object):
         self.distros = collection_mgr.distros()
         self.profiles = collection_mgr.profiles()
         self.systems = collection_mgr.systems()
+        self.images = collection_mgr.images()
         self.settings = collection_mgr.settings()
         self.repos = collection_mgr.repos()
         self.templar = templar.Templar(collection_mgr, self.logger)
@@ -65,19 +154,31 @@ class CobblerSync(object):
         self.dns.verbose = verbose
         self.dhcp.verbose = verbose
 
-        self.pxelinux_dir = os.path.join(self.bootloc, "pxelinux.cfg")
-        self.grub_dir = os.path.join(self.bootloc, "grub")
-        self.images_dir = os.path.join(self.bootloc, "images")
-        self.yaboot_bin_dir = os.path.join(self.bootloc, "ppc")
-        self.yaboot_cfg_dir = os.path.join(self.bootloc, "etc")
-        self.rendered_dir = os.path.join(self.settings.webdir, "rendered")
-
-    def run(self):
+        # bootloc and webdir are always absolute POSIX paths, so plain string
+        # interpolation beats the per-component checks in os.path.join
+        bootloc = self.bootloc
+        self.pxelinux_dir = f"{bootloc}/pxelinux.cfg"
+        self.grub_dir = f"{bootloc}/grub"
+        self.images_dir = f"{bootloc}/images"
+        self.yaboot_bin_dir = f"{bootloc}/ppc"
+        self.yaboot_cfg_dir = f"{bootloc}/etc"
+        self.rendered_dir = f"{self.settings.webdir}/rendered"
+        # background deletion threads started by clean_trees; joined in run()
+        self.cleanup_threads = []
+
+    def run(self, force=False):
         """
         Syncs the current configuration file with the config tree.
         Using the Check().run_ functions previously is recommended
+
+        force, if given, rebuilds the trees even when the object state is
+        unchanged since the last sync.
         """
-        if not os.path.exists(self.bootloc):
+        # one stat both validates that the tree exists and feeds the
+        # unchanged-state check below
+        try:
+            boot_st = os.stat(self.bootloc)
+        except FileNotFoundError:
             utils.die(self.logger, "cannot find directory: %s" % self.bootloc)
 
         self.logger.info("running pre-sync triggers")
@@ -85,11 +186,21 @@ class CobblerSync(object):
         # run pre-triggers...
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/pre/*")
 
-        self.distros = self.collection_mgr.distros()
-        self.profiles = self.collection_mgr.profiles()
-        self.systems = self.collection_mgr.systems()
-        self.settings = self.collection_mgr.settings()
-        self.repos = self.collection_mgr.repos()
+        # no need to re-fetch the collections here: the collection manager
+        # hands out its persistent singletons, so the references bound in
+        # __init__ already observe any changes made since then
+
+        # if nothing relevant changed since the last sync and nobody touched
+        # the tftpboot tree since, skip the expensive teardown/rebuild and
+        # only fire the triggers
+        state_hash = self.get_state_hash()
+        state = "%s %d" % (state_hash, boot_st.st_mtime_ns)
+        if not force and state == self.read_sync_state():
+            self.logger.info("object state unchanged since last sync, skipping tree rebuild")
+            self.logger.info("running post-sync triggers")
+            utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
+            utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
+            return True
 
         # execute the core of the sync operation
         self.logger.info("cleaning trees")
@@ -110,15 +221,25 @@ class CobblerSync(object):
             except CX as e:
                 self.logger.error(e.value)
 
-        # make the default pxe menu anyway...
-        self.tftpgen.make_pxe_menu()
-
-        if self.settings.manage_dhcp:
-            self.write_dhcp()
-        if self.settings.manage_dns:
-            self.logger.info("rendering DNS files")
-            self.dns.regen_hosts()
-            self.dns.write_dns_files()
+        # the PXE menu and the DHCP/DNS/rsync renderers each write their own
+        # config files, so run them concurrently; the wall-clock cost of this
+        # block becomes the longest single phase instead of the sum
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # make the default pxe menu anyway...
+            futures = [executor.submit(self.tftpgen.make_pxe_menu)]
+            if self.settings.manage_dhcp:
+                self.logger.info("rendering DHCP files")
+                futures.append(executor.submit(self.dhcp.write_dhcp_file))
+                futures.append(executor.submit(self.dhcp.regen_ethers))
+            if self.settings.manage_dns:
+                self.logger.info("rendering DNS files")
+                futures.append(executor.submit(self.dns.regen_hosts))
+                futures.append(executor.submit(self.dns.write_dns_files))
+            if self.settings.manage_rsync:
+                self.logger.info("rendering Rsync files")
+                futures.append(executor.submit(self.rsync_gen))
+            for future in futures:
+                future.result()
 
         if self.settings.manage_tftpd:
             # copy in boot_files
@@ -127,34 +248,84 @@ class CobblerSync(object):
         self.logger.info("cleaning link caches")
         self.clean_link_cache()
 
-        if self.settings.manage_rsync:
-            self.logger.info("rendering Rsync files")
-            self.rsync_gen()
+        # make sure the background tree removals from clean_trees have
+        # finished before anything downstream can observe the scratch dirs
+        for thread in self.cleanup_threads:
+            thread.join()
+        self.cleanup_threads = []
+
+        if self.settings.batch_fsync:
+            self.logger.info("flushing sync output to disk")
+            self.batch_fsync()
+
+        # record what this sync saw so an unchanged installation can take
+        # the fast path next time.  The hash is the one computed at the top
+        # of the run: an object edited over XML-RPC while the files were
+        # being written must invalidate the next run's fast path, so only
+        # the tftpboot mtime is refreshed after all writes have landed
+        self.write_sync_state("%s %d" % (state_hash, os.stat(self.bootloc).st_mtime_ns))
 
         # run post-triggers
         self.logger.info("running post-sync triggers")
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
 
+    def get_state_hash(self):
+        """
+        Hash of the object state a sync materializes; item mtimes are bumped
+        on every edit, so any add/edit/remove changes the digest.
+        """
+        state = []
+        for collection in (self.distros, self.profiles, self.systems,
+                           self.images, self.repos):
+            state.append(sorted((obj.name, obj.mtime) for obj in collection))
+        # template edits change sync output without touching any object
+        # mtime, so fold those trees in too: /etc/cobbler carries the
+        # settings file plus the dhcp/dns/rsync and zone templates, the
+        # other directories the bootloader configs, autoinstall templates
+        # and snippets
+        for directory in ("/etc/cobbler",
+                          self.settings.boot_loader_conf_template_dir,
+                          self.settings.autoinstall_templates_dir,
+                          self.settings.autoinstall_snippets_dir):
+            sources = []
+            for dirpath, _dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    try:
+                        sources.append((filepath, os.stat(filepath).st_mtime_ns))
+                    except OSError:
+                        continue
+            state.append(sorted(sources))
+        return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
+
+    def read_sync_state(self):
+        try:
+            with open(_SYNC_STATE_FILE, "r") as statefile:
+                return statefile.read().strip()
+        except OSError:
+            return None
+
+    def write_sync_state(self, state):
+        try:
+            with open(_SYNC_STATE_FILE, "w") as statefile:
+                statefile.write(state)
+        except OSError:
+            # losing the record only costs the next sync its fast path
+            self.logger.warning("unable to write %s" % _SYNC_STATE_FILE)
+
     def make_tftpboot(self):
         """
         Make directories for tftpboot images
         """
-        if not os.path.exists(self.pxelinux_dir):
-            utils.mkdir(self.pxelinux_dir, logger=self.logger)
-        if not os.path.exists(self.grub_dir):
-            utils.mkdir(self.grub_dir, logger=self.logger)
+        # utils.mkdir tolerates existing directories, so there is no need to
+        # stat each path before creating it
+        for path in (self.pxelinux_dir, self.grub_dir, self.images_dir,
+                     self.rendered_dir, self.yaboot_bin_dir, self.yaboot_cfg_dir):
+            utils.mkdir(path, logger=self.logger)
         grub_images_link = os.path.join(self.grub_dir, "images")
-        if not os.path.exists(grub_images_link):
+        if not os.path.lexists(grub_images_link):
             os.symlink("../images", grub_images_link)
-        if not os.path.exists(self.images_dir):
-            utils.mkdir(self.images_dir, logger=self.logger)
-        if not os.path.exists(self.rendered_dir):
-            utils.mkdir(self.rendered_dir, logger=self.logger)
-        if not os.path.exists(self.yaboot_bin_dir):
-            utils.mkdir(self.yaboot_bin_dir, logger=self.logger)
-        if not os.path.exists(self.yaboot_cfg_dir):
-            utils.mkdir(self.yaboot_cfg_dir, logger=self.logger)
 
     def clean_trees(self):
         """
@@ -170,26 +341,79 @@ class CobblerSync(object):
         """
 
         # clean out parts of webdir and all of /tftpboot/images and /tftpboot/pxelinux.cfg
-        for x in os.listdir(self.settings.webdir):
-            path = os.path.join(self.settings.webdir, x)
-            if os.path.isfile(path):
-                if not x.endswith(".py"):
-                    utils.rmfile(path, logger=self.logger)
-            if os.path.isdir(path):
-                if x not in self.settings.webdir_whitelist:
+        # use scandir so each entry's file/dir type comes from the directory
+        # listing itself instead of a separate stat() call per entry
+        webdir_whitelist = frozenset(self.settings.webdir_whitelist)
+        clean_targets = []
+        with os.scandir(self.settings.webdir) as entries:
+            for entry in entries:
+                is_file = entry.is_file(follow_symlinks=False)
+                if not is_file and not entry.is_dir(follow_symlinks=False):
+                    continue
+                action = _classify_webdir_entry(entry.name, is_file, webdir_whitelist)
+                if action == "rmfile":
+                    utils.rmfile(entry.path, logger=self.logger)
+                elif action == "rmtree":
                     # delete directories that shouldn't exist
-                    utils.rmtree(path, logger=self.logger)
-                if x in ["autoinstall_templates", "autoinstall_templates_sys", "images", "systems", "distros", "profiles", "repo_profile", "repo_system", "rendered"]:
+                    utils.rmtree(entry.path, logger=self.logger)
+                elif action == "clean":
                     # clean out directory contents
-                    utils.rmtree_contents(path, logger=self.logger)
-        #
+                    clean_targets.append(entry.path)
+        utils.bulk_rmtree_contents(clean_targets, logger=self.logger)
+        # rename each tree to a scratch name and recreate it empty; that is
+        # one syscall per tree instead of one unlink per file, and the real
+        # deletion overlaps with the rest of the sync on background threads
+        for path in (self.pxelinux_dir, self.grub_dir,
+                     self.yaboot_bin_dir, self.yaboot_cfg_dir, self.rendered_dir):
+            self.detach_tree_for_removal(path)
         self.make_tftpboot()
-        utils.rmtree_contents(self.pxelinux_dir, logger=self.logger)
-        utils.rmtree_contents(self.grub_dir, logger=self.logger)
+        # the images tree keeps its hidden .link_cache between syncs so
+        # kernels and initrds can be re-hardlinked instead of re-copied, so
+        # clean its contents in place; rmtree_contents skips hidden entries
         utils.rmtree_contents(self.images_dir, logger=self.logger)
-        utils.rmtree_contents(self.yaboot_bin_dir, logger=self.logger)
-        utils.rmtree_contents(self.yaboot_cfg_dir, logger=self.logger)
-        utils.rmtree_contents(self.rendered_dir, logger=self.logger)
+
+    def remove_tree_in_background(self, path):
+        thread = threading.Thread(target=shutil.rmtree, args=(path,),
+                                  kwargs={"ignore_errors": True}, daemon=True)
+        thread.start()
+        self.cleanup_threads.append(thread)
+
+    def detach_tree_for_removal(self, path):
+        """
+        Move a directory tree aside with a single rename and delete it on a
+        daemon thread, so the caller can recreate the directory immediately
+        while the O(files) unlinking runs in the background.  The threads
+        are collected in self.cleanup_threads and joined at the end of run().
+        """
+        # sweep scratch dirs that survived an earlier run (a process that
+        # crashed before the join, or a background rmtree that gave up
+        # silently on e.g. NFS silly-renamed files), from any pid; a
+        # leftover with our fresh scratch name would make the rename fail
+        # and abort every subsequent sync
+        prefix = path + ".old."
+        try:
+            with os.scandir(os.path.dirname(path)) as entries:
+                leftovers = [entry.path for entry in entries if entry.path.startswith(prefix)]
+        except FileNotFoundError:
+            leftovers = []
+        for leftover in leftovers:
+            self.remove_tree_in_background(leftover)
+        scratch = "%s.old.%d.%d" % (path, os.getpid(), next(_SCRATCH_SERIAL))
+        try:
+            os.rename(path, scratch)
+        except OSError as ose:
+            if ose.errno != errno.ENOENT:
+                raise
+            return
+        self.remove_tree_in_background(scratch)
+
+    def batch_fsync(self):
+        """
+        Flush everything a sync wrote to stable storage in one pass, so a
+        single filesystem transaction commit covers all of the small files
+        instead of each of them being flushed on its own.
+        """
+        os.sync()
 
     def write_dhcp(self):
         self.logger.info("rendering DHCP files")
@@ -215,24 +439,30 @@ class CobblerSync(object):
         template_file = "/etc/cobbler/rsync.template"
 
         try:
-            template = open(template_file, "r")
-        except:
+            template_data = _load_template(template_file)
+        except OSError:
             raise CX(_("error reading template %s") % template_file)
 
-        template_data = ""
-        template_data = template.read()
-        template.close()
-
-        distros = []
-
-        for link in glob.glob(os.path.join(self.settings.webdir, 'links', '*')):
-            distro = {}
-            distro["path"] = os.path.realpath(link)
-            distro["name"] = os.path.basename(link)
-            distros.append(distro)
+        # the template only iterates these, so build them in one pass as
+        # tuples, which are a bit cheaper than lists for read-only use
+        try:
+            with os.scandir(os.path.join(self.settings.webdir, 'links')) as entries:
+                # the glob this replaced never matched hidden entries; keep
+                # that so e.g. NFS .nfs* leftovers don't become rsync modules
+                distros = tuple({"path": os.path.realpath(entry.path), "name": entry.name}
+                                for entry in entries if not entry.name.startswith("."))
+        except FileNotFoundError:
+            distros = ()
+
+        # read repo_mirror once and intersect with the repo collection in
+        # memory, instead of issuing one isdir() stat per repo
+        try:
+            with os.scandir(os.path.join(self.settings.webdir, "repo_mirror")) as entries:
+                repos_existing = {entry.name for entry in entries if entry.is_dir(follow_symlinks=False)}
+        except FileNotFoundError:
+            repos_existing = set()
 
-        repos = [repo.name for repo in self.api.repos()
-                 if os.path.isdir(os.path.join(self.settings.webdir, "repo_mirror", repo.name))]
+        repos = tuple(repo.name for repo in self.api.repos() if repo.name in repos_existing)
 
         metadata = {
             "date": time.asctime(time.gmtime()),
@@ -242,4 +472,26 @@ class CobblerSync(object):
             "webdir": self.settings.webdir
         }
 
-        self.templar.render(template_data, metadata, "/etc/rsyncd.conf", None)
+        # a template that opts into jinja2 is rendered through a cached
+        # compiled template and written atomically, bypassing the Cheetah
+        # machinery entirely; everything else goes through the templar.
+        # The template shipped by cobbler uses Cheetah syntax, so this only
+        # kicks in when the administrator has converted their copy.
+        first_line, _sep, rest = template_data.partition("\n")
+        if first_line.strip().lower() == "#template=jinja2":
+            if not jinja2_available:
+                # falling through to the templar would only produce a much
+                # more confusing failure while trying to honor the directive
+                raise CX(_("jinja2 is not available, cannot render %s") % template_file)
+            rendered = _compiled_jinja_template(rest).render(metadata)
+            tmp_path = "/etc/rsyncd.conf.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                buf = rendered.encode('utf-8')
+                while buf:
+                    buf = buf[os.write(fd, buf):]
+            finally:
+                os.close(fd)
+            os.rename(tmp_path, "/etc/rsyncd.conf")
+        else:
+            self.templar.render(template_data, metadata, "/etc/rsyncd.conf", None)
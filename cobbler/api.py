@@ -707,16 +707,17 @@ class CobblerAPI(object):
 
     # ==========================================================================
 
-    def sync(self, verbose=False, logger=None):
+    def sync(self, verbose=False, logger=None, force=False):
         """
         Take the values currently written to the configuration files in
         /etc, and /var, and build out the information tree found in
         /tftpboot.  Any operations done in the API that have not been
         saved with serialize() will NOT be synchronized with this command.
+        force rebuilds the trees even when no object changes are detected.
         """
         self.log("sync")
         sync = self.get_sync(verbose=verbose, logger=logger)
-        sync.run()
+        sync.run(force=force)
 
     # ==========================================================================
 
@@ -620,8 +620,9 @@ class CobblerCLI(object):
                 print("No configuration problems found.  All systems go.")
 
         elif action_name == "sync":
-            (options, args) = self.parser.parse_args()
             self.parser.add_option("--verbose", dest="verbose", action="store_true", help="run sync with more output")
+            self.parser.add_option("--force", dest="force", action="store_true", help="rebuild the trees even if no object changes are detected")
+            (options, args) = self.parser.parse_args()
             task_id = self.start_task("sync", options)
         elif action_name == "report":
             (options, args) = self.parser.parse_args()
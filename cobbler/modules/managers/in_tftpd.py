@@ -18,7 +18,9 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 """
 
 from builtins import object
+from concurrent.futures import ThreadPoolExecutor
 import glob
+import os
 import os.path
 import shutil
 
@@ -162,8 +164,17 @@ class InTftpdManager(object):
         # the actual pxelinux.cfg files, for each interface
         self.logger.info("generating PXE configuration files")
         menu_items = self.tftpgen.get_menu_items()['pxe']
-        for x in self.systems:
-            self.tftpgen.write_all_system_files(x, menu_items)
+        systems = list(self.systems)
+        if len(systems) < 4:
+            # not worth spinning up a pool for a handful of systems
+            for x in systems:
+                self.tftpgen.write_all_system_files(x, menu_items)
+        else:
+            # each system renders into its own pxelinux.cfg/grub files, so
+            # dispatch them to a bounded thread pool to overlap the many
+            # small template writes (helps a lot on NFS-backed tftpboot)
+            with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4)) as executor:
+                list(executor.map(lambda x: self.tftpgen.write_all_system_files(x, menu_items), systems))
 
         self.logger.info("generating PXE menu structure")
         self.tftpgen.make_pxe_menu()
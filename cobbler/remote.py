@@ -182,7 +182,7 @@ class CobblerXMLRPCInterface(object):
 
     def background_sync(self, options, token):
         def runner(self):
-            self.remote.api.sync(self.options.get("verbose", False), logger=self.logger)
+            self.remote.api.sync(self.options.get("verbose", False), logger=self.logger, force=self.options.get("force", False))
         return self.__start_task(runner, token, "sync", "Sync", options)
 
     def background_hardlink(self, options, token):
@@ -43,6 +43,7 @@ DEFAULTS = {
     "authn_pam_service": ["login", "str"],
     "autoinstall_snippets_dir": ["/var/lib/cobbler/snippets", "str"],
     "autoinstall_templates_dir": ["/var/lib/cobbler/templates", "str"],
+    "batch_fsync": [0, "bool"],
     "bind_chroot_path": ["", "str"],
     "bind_master": ["127.0.0.1", "str"],
     "boot_loader_conf_template_dir": ["/etc/cobbler/boot_loader_conf", "str"],
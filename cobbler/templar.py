@@ -47,6 +47,14 @@ from . import utils
 major, minor, release = Cheetah.Version.split('.')[0:3]
 fix_cheetah_class = (int(major), int(minor), int(release)) >= (2, 4, 2)
 
+# Cheetah template classes keyed on the template source text.  Compiling a
+# template into a Python class is by far the most expensive part of a render,
+# and the same source is rendered over and over during a sync (once per
+# system/profile), so reuse the compiled class and only pay for instantiation
+# and respond().  An edited template produces different source text and
+# therefore simply misses the cache.
+_COMPILED_TEMPLATE_CACHE = {}
+
 
 class Templar(object):
 
@@ -142,9 +150,16 @@ class Templar(object):
         # if requested, write the data out to a file
         if out_path is not None:
             utils.mkdir(os.path.dirname(out_path))
-            fd = open(out_path, "w+")
-            fd.write(data_out)
-            fd.close()
+            # the whole rendered result is already in memory, so emit it
+            # with one write syscall instead of going through a buffered
+            # file object (open/write/flush/close)
+            fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                buf = data_out.encode('utf-8')
+                while buf:
+                    buf = buf[os.write(fd, buf):]
+            finally:
+                os.close(fd)
 
         return data_out
 
@@ -197,7 +212,11 @@ class Templar(object):
         })
 
         # now do full templating scan, where we will also templatify the snippet insertions
-        t = Template(source=raw_data, searchList=[search_table], compilerSettings={'useStackFrame': False})
+        compiled = _COMPILED_TEMPLATE_CACHE.get(raw_data)
+        if compiled is None:
+            compiled = Template.compile(source=raw_data, compilerSettings={'useStackFrame': False})
+            _COMPILED_TEMPLATE_CACHE[raw_data] = compiled
+        t = compiled(searchList=[search_table])
 
         if fix_cheetah_class:
             t.SNIPPET = functools.partial(t.SNIPPET, t)
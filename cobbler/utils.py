@@ -809,6 +809,28 @@ def run_this(cmd, args, logger):
         die(logger, "Command failed")
 
 
+# a glob of the form "<literal directory>/*", which is what every trigger
+# path in the tree looks like; such patterns need no fnmatch filtering
+_TRIGGER_GLOB_RE = re.compile(r'^(/[^*?\[\]]+)/\*$')
+
+
+def _expand_trigger_glob(globber):
+    """
+    Expand a trigger glob.  The common "<literal directory>/*" form is served
+    by a single scandir of that directory; anything fancier falls back to
+    glob.glob.
+    """
+    match = _TRIGGER_GLOB_RE.match(globber)
+    if match is None:
+        return sorted(glob.glob(globber))
+    try:
+        with os.scandir(match.group(1)) as entries:
+            # glob never matches hidden entries; keep that behavior
+            return sorted(entry.path for entry in entries if not entry.name.startswith("."))
+    except FileNotFoundError:
+        return []
+
+
 def run_triggers(api, ref, globber, additional=[], logger=None):
     """
     Runs all the trigger scripts in a given directory.
@@ -843,8 +865,7 @@ def run_triggers(api, ref, globber, additional=[], logger=None):
 
     if logger is not None:
         logger.debug("running shell triggers from %s" % globber)
-    triggers = glob.glob(globber)
-    triggers.sort()
+    triggers = _expand_trigger_glob(globber)
     for file in triggers:
         try:
             if file.startswith(".") or file.find(".rpm") != -1:
@@ -1113,10 +1134,57 @@ def rmfile(path, logger=None):
         return True
 
 
+def _fast_rmtree(path):
+    """
+    Recursively delete a tree with os.scandir, reusing the entry type from
+    the directory listing instead of stat'ing every entry the way
+    shutil.rmtree does.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _fast_rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
 def rmtree_contents(path, logger=None):
-    what_to_delete = glob.glob("%s/*" % path)
-    for x in what_to_delete:
-        rmtree(x, logger=logger)
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    # the old glob-based implementation skipped hidden
+                    # entries (e.g. .link_cache); keep that behavior
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if logger is not None:
+                        logger.info("removing: %s" % entry.path)
+                    try:
+                        _fast_rmtree(entry.path)
+                    except OSError:
+                        # directory removal has always been best-effort here
+                        # (shutil.rmtree ran with ignore_errors=True); keep
+                        # that, but at least log the failure now
+                        if logger is not None:
+                            log_exc(logger)
+                else:
+                    # file removal failures raise CX, as they always have
+                    rmfile(entry.path, logger=logger)
+    except FileNotFoundError:
+        return
+
+
+def bulk_rmtree_contents(paths, logger=None):
+    """
+    Clean out the contents of several directories in turn.  Failures
+    propagate exactly as from rmtree_contents: a file deletion error raises
+    CX and aborts the operation (masking ENOSPC or permission problems by
+    carrying on would only corrupt the rebuild), while directory deletion
+    errors are logged and skipped.
+    """
+    for path in paths:
+        rmtree_contents(path, logger=logger)
 
 
 def rmtree(path, logger=None):
@@ -1139,7 +1207,7 @@ def mkdir(path, mode=0o755, logger=None):
     try:
         if logger is not None:
             logger.info("mkdir: %s" % path)
-        return os.makedirs(path, mode)
+        return os.makedirs(path, mode, exist_ok=True)
     except OSError as oe:
         if not oe.errno == 17:  # already exists (no constant for 17?)
             if logger is not None: